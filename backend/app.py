@@ -1,10 +1,12 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, make_response, Response
 from flask_cors import CORS
+from functools import wraps
 import os
 import base64
 import cv2
 import numpy as np
 from tumor_detector import TraditionalTumorDetector
+from profiler import RequestProfiler
 import traceback
 import logging
 
@@ -66,14 +68,26 @@ class CustomTumorDetector(TraditionalTumorDetector):
 # Initialize the detector
 detector = CustomTumorDetector(dataset_path='dummy')  # Path is not used in custom loader
 
-# Train the model on startup
-try:
-    logger.info("Training the model with your dataset...")
-    detector.train_model(model_type='random_forest')
-    logger.info("Model training completed successfully!")
-except Exception as e:
-    logger.error(f"Error during model training: {str(e)}")
-    logger.error("Please check if the dataset paths are correct and contain valid images.")
+# Load a model exported by train.py if one is configured, otherwise train on startup
+MODEL_PATH = os.environ.get('MODEL_PATH')
+if MODEL_PATH:
+    if not os.path.exists(MODEL_PATH):
+        logger.error(f"Model file not found: {MODEL_PATH}. Falling back to training on startup.")
+    else:
+        try:
+            metadata = detector.load_model(MODEL_PATH)
+            logger.info(f"Using {metadata.get('model_type')} model (CV accuracy: {metadata.get('cv_accuracy')})")
+        except Exception as e:
+            logger.error(f"Error loading model from {MODEL_PATH}: {str(e)}")
+
+if detector.classifier is None:
+    try:
+        logger.info("Training the model with your dataset...")
+        detector.train_model(model_type='random_forest')
+        logger.info("Model training completed successfully!")
+    except Exception as e:
+        logger.error(f"Error during model training: {str(e)}")
+        logger.error("Please check if the dataset paths are correct and contain valid images.")
 
 # Import the Result model for database storage
 import sys
@@ -92,7 +106,52 @@ NODE_BACKEND_URL = 'http://localhost:3002/api/results/save'
 # API key for secure communication between backends
 API_KEY = os.environ.get('PYTHON_API_KEY', 'default_dev_key_change_in_production')
 
+# Opt-in request profiling. A request is profiled when it sends the X-Profile header
+# along with a valid X-API-Key, when it is sampled (PROFILE_SAMPLE_RATE, 0.0 - 1.0),
+# or when it is slower than PROFILE_SLOW_MS. The first two are fully traced; slow
+# requests are only caught by a low-overhead stack sampler, so the threshold can stay
+# enabled for all traffic.
+# The last PROFILE_RING_SIZE profiles can be downloaded from /api/admin/profiles.
+PROFILE_SLOW_MS = os.environ.get('PROFILE_SLOW_MS')
+profiler = RequestProfiler(
+    sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', '0')),
+    slow_threshold_ms=float(PROFILE_SLOW_MS) if PROFILE_SLOW_MS else None,
+    max_profiles=int(os.environ.get('PROFILE_RING_SIZE', '20'))
+)
+
+def profiled(name):
+    """Run the view under the request profiler when profiling is enabled for this request"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Tracing is expensive, so only trusted callers may force it
+            forced = (request.headers.get('X-Profile', '').lower() in ('1', 'true', 'yes')
+                      and has_valid_api_key())
+            reason = profiler.should_profile(forced=forced)
+            if reason is None:
+                return view(*args, **kwargs)
+
+            rv, profile_id = profiler.run(name, reason, view, *args, **kwargs)
+            response = make_response(rv)
+            if profile_id:
+                response.headers['X-Profile-Id'] = profile_id
+            return response
+        return wrapper
+    return decorator
+
+def has_valid_api_key():
+    return request.headers.get('X-API-Key') == API_KEY
+
+def require_api_key(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not has_valid_api_key():
+            return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
 @app.route('/api/detect', methods=['POST'])
+@profiled('detect_tumor')
 def detect_tumor():
     try:
         if detector.classifier is None:
@@ -258,5 +317,35 @@ def get_results():
         # In production, this should be restricted to authenticated admin users
         return jsonify(results_history)
 
+@app.route('/api/admin/profiles', methods=['GET'])
+@require_api_key
+def list_profiles():
+    return jsonify(profiler.list_profiles())
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+@require_api_key
+def download_profile(profile_id):
+    # kind: cpu (self time in microseconds), calls (call counts) or alloc (allocated bytes)
+    kind = request.args.get('kind', 'cpu')
+    profile = profiler.get_profile(profile_id)
+    if profile is None:
+        return jsonify({'success': False, 'error': 'Profile not found'}), 404
+    if kind == 'alloc' and profile['alloc_stacks'] is None:
+        return jsonify({'success': False, 'error': 'Allocation tracing was not captured for this profile'}), 404
+    if kind == 'calls' and profile['call_counts'] is None:
+        return jsonify({'success': False, 'error': 'Call counts are not available for sampled profiles'}), 404
+
+    try:
+        folded = profiler.to_folded(profile, kind)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    filename = f"{profile['name']}-{profile_id}.{kind}.folded"
+    return Response(
+        folded,
+        mimetype='text/plain',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
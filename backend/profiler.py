@@ -0,0 +1,281 @@
+import os
+import sys
+import time
+import uuid
+import random
+import threading
+import tracemalloc
+from collections import deque, defaultdict
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _builtin_label(func):
+    module = getattr(func, '__module__', None) or 'builtins'
+    name = getattr(func, '__qualname__', None) or getattr(func, '__name__', repr(func))
+    return f"{module}.{name}"
+
+
+class _CallTreeTracer:
+    """Records self time per call stack using sys.setprofile (current thread only)
+
+    With track_memory, tracemalloc's peak is read and reset on every call and return,
+    and the growth above the memory in use at the previous event is counted as bytes
+    allocated by the function running in between. Temporaries freed before the call
+    returns are included. tracemalloc is process wide though, so allocations made
+    by other threads at the same time are attributed to this call as well.
+    """
+
+    def __init__(self, root, track_memory=False):
+        self.root = root
+        self.track_memory = track_memory
+        self.stack = []  # [label path, start time, time spent in children]
+        self.self_time = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.allocated = defaultdict(int)
+        self.peak_bytes = 0
+        self._start_memory = 0
+        self._last_memory = 0
+
+    def _record_memory(self):
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        if peak > self._last_memory:
+            path = self.stack[-1][0] if self.stack else (self.root,)
+            self.allocated[path] += peak - self._last_memory
+        self.peak_bytes = max(self.peak_bytes, peak - self._start_memory)
+        self._last_memory = current
+
+    def _push(self, label):
+        path = (self.stack[-1][0] if self.stack else (self.root,)) + (label,)
+        self.stack.append([path, time.perf_counter(), 0.0])
+        self.calls[path] += 1
+
+    def _pop(self):
+        if not self.stack:
+            # Returns from frames entered before tracing started
+            return
+        path, start, child = self.stack.pop()
+        total = time.perf_counter() - start
+        self.self_time[path] += total - child
+        if self.stack:
+            self.stack[-1][2] += total
+
+    def __call__(self, frame, event, arg):
+        if self.track_memory:
+            self._record_memory()
+        if event == 'call':
+            self._push(_frame_label(frame.f_code))
+        elif event.startswith('c_') and arg is sys.setprofile:
+            # Installing and removing the tracer is not part of the profiled call
+            return
+        elif event == 'c_call':
+            self._push(_builtin_label(arg))
+        else:  # return, c_return, c_exception
+            self._pop()
+
+    def run(self, func, *args, **kwargs):
+        if self.track_memory:
+            tracemalloc.reset_peak()
+            self._start_memory = self._last_memory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        sys.setprofile(self)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sys.setprofile(None)
+            if self.track_memory:
+                self._record_memory()
+            self.stack.clear()
+            self.wall_time = time.perf_counter() - start
+
+
+class _StackSampler:
+    """Samples another thread's Python stack every interval using sys._current_frames()
+
+    Much cheaper than _CallTreeTracer, so it can run on every request, but it only sees
+    Python frames (time in C code is attributed to the Python function that called it).
+    """
+
+    def __init__(self, root, thread_id, interval=0.005):
+        self.root = root
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = defaultdict(float)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample_loop, daemon=True)
+
+    def _sample_loop(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            # Waking up can be delayed by the GIL, so weight by the real time between samples
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            frame = sys._current_frames().get(self.thread_id)
+            labels = []
+            while frame is not None and frame.f_code is not _SAMPLED_CALL:
+                labels.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if frame is not None:
+                # Only count samples taken inside the profiled call
+                self.samples[(self.root,) + tuple(reversed(labels))] += elapsed
+
+    def run(self, func, *args, **kwargs):
+        self._thread.start()
+        try:
+            return _sampled_call(func, args, kwargs)
+        finally:
+            self._stop.set()
+            self._thread.join()
+
+
+def _sampled_call(func, args, kwargs):
+    # Marks where the sampled stack starts
+    return func(*args, **kwargs)
+
+
+_SAMPLED_CALL = _sampled_call.__code__
+
+
+class RequestProfiler:
+    """Opt-in per-request profiler that keeps the most recent profiles in a bounded ring.
+
+    A call is traced in full (call tree, call counts and allocations) when it is forced
+    (e.g. by a request header) or picked by random sampling. If a latency threshold is
+    set, every other call runs uninstrumented with a low-overhead stack sampler alongside,
+    and the sampled profile is kept only when the call is slower than the threshold.
+    """
+
+    def __init__(self, sample_rate=0.0, slow_threshold_ms=None, max_profiles=20,
+                 trace_allocations=True, sample_interval=0.005):
+        self.sample_rate = sample_rate
+        self.slow_threshold_ms = slow_threshold_ms
+        self.sample_interval = sample_interval
+        self.trace_allocations = trace_allocations
+        self._profiles = deque(maxlen=max_profiles)
+        self._lock = threading.Lock()
+        # tracemalloc is process wide, so only one profile may own it at a time
+        self._alloc_lock = threading.Lock()
+
+    def should_profile(self, forced=False):
+        """Return the reason this call should be profiled, or None"""
+        if forced:
+            return 'header'
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return 'sampled'
+        if self.slow_threshold_ms is not None:
+            return 'slow'
+        return None
+
+    def run(self, name, reason, func, *args, **kwargs):
+        """Call func under the profiler; returns (result, profile id or None)"""
+        if reason == 'slow':
+            return self._run_sampled(name, reason, func, *args, **kwargs)
+        return self._run_traced(name, reason, func, *args, **kwargs)
+
+    def _run_sampled(self, name, reason, func, *args, **kwargs):
+        sampler = _StackSampler(name, threading.get_ident(), self.sample_interval)
+        start = time.perf_counter()
+        result = sampler.run(func, *args, **kwargs)
+        wall_ms = (time.perf_counter() - start) * 1000
+        if wall_ms < self.slow_threshold_ms:
+            return result, None
+
+        return result, self._store(name, reason, 'stack_sample', wall_ms, dict(sampler.samples))
+
+    def _run_traced(self, name, reason, func, *args, **kwargs):
+        owns_alloc = self.trace_allocations and self._alloc_lock.acquire(blocking=False)
+        tracer = _CallTreeTracer(name, track_memory=owns_alloc)
+        started_tracemalloc = False
+        try:
+            if owns_alloc and not tracemalloc.is_tracing():
+                # Only totals are read, so a single frame per trace keeps the overhead down
+                tracemalloc.start(1)
+                started_tracemalloc = True
+            result = tracer.run(func, *args, **kwargs)
+        finally:
+            if owns_alloc:
+                if started_tracemalloc:
+                    tracemalloc.stop()
+                self._alloc_lock.release()
+
+        profile_id = self._store(name, reason, 'trace', tracer.wall_time * 1000, dict(tracer.self_time),
+                                 call_counts=dict(tracer.calls),
+                                 alloc_stacks=dict(tracer.allocated) if owns_alloc else None,
+                                 peak_alloc_bytes=tracer.peak_bytes if owns_alloc else None)
+        return result, profile_id
+
+    def _store(self, name, reason, mode, wall_ms, cpu_stacks, call_counts=None, alloc_stacks=None,
+               peak_alloc_bytes=None):
+        profile = {
+            'id': uuid.uuid4().hex,
+            'name': name,
+            'reason': reason,
+            'mode': mode,
+            'timestamp': int(time.time()),
+            'wall_ms': round(wall_ms, 3),
+            'peak_alloc_bytes': peak_alloc_bytes,
+            'cpu_stacks': cpu_stacks,
+            'call_counts': call_counts,
+            'alloc_stacks': alloc_stacks,
+        }
+        with self._lock:
+            self._profiles.append(profile)
+        logger.info(f"Captured {reason} profile {profile['id']} for {name} ({wall_ms:.1f} ms)")
+        return profile['id']
+
+    def list_profiles(self):
+        """Summaries of the retained profiles, newest first"""
+        with self._lock:
+            profiles = list(self._profiles)
+
+        summaries = []
+        for p in reversed(profiles):
+            summaries.append({
+                'id': p['id'],
+                'name': p['name'],
+                'reason': p['reason'],
+                'mode': p['mode'],
+                'timestamp': p['timestamp'],
+                'wall_ms': p['wall_ms'],
+                'peak_alloc_bytes': p['peak_alloc_bytes'],
+                'has_calls': p['call_counts'] is not None,
+                'has_alloc': p['alloc_stacks'] is not None,
+            })
+        return summaries
+
+    def get_profile(self, profile_id):
+        with self._lock:
+            for p in self._profiles:
+                if p['id'] == profile_id:
+                    return p
+        return None
+
+    @staticmethod
+    def to_folded(profile, kind='cpu'):
+        """Render a profile in the collapsed-stack format read by flamegraph.pl, speedscope and inferno.
+
+        CPU stacks are weighted by self time in microseconds, call stacks by the number
+        of calls, and allocation stacks by the bytes allocated in each function.
+        """
+        if kind == 'cpu':
+            stacks = {path: int(round(t * 1e6)) for path, t in profile['cpu_stacks'].items()}
+        elif kind == 'calls':
+            stacks = profile['call_counts'] or {}
+        elif kind == 'alloc':
+            stacks = profile['alloc_stacks'] or {}
+        else:
+            raise ValueError(f"Unsupported profile kind: {kind}")
+
+        lines = []
+        for path, weight in sorted(stacks.items()):
+            if weight <= 0:
+                continue
+            # ';' separates frames and the last space separates the weight
+            frames = [f.replace(';', ':') for f in path]
+            lines.append(f"{';'.join(frames)} {weight}")
+        return '\n'.join(lines) + '\n'
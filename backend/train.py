@@ -0,0 +1,295 @@
+"""Offline model training for TumourScope.
+
+Extracts features from the dataset once (cached to disk), runs a parallel stratified
+k-fold search over model types and hyperparameters, and exports the best model as an
+artifact that app.py can load with MODEL_PATH instead of training on startup.
+
+Usage: python train.py --dataset ../Datasets --output model.joblib
+"""
+import argparse
+import hashlib
+import inspect
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import StratifiedKFold
+
+from tumor_detector import TraditionalTumorDetector
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Hyperparameters searched for each model type
+SEARCH_SPACE = {
+    'random_forest': {
+        'n_estimators': [100, 300],
+        'max_depth': [None, 20],
+        'min_samples_leaf': [1, 3],
+    },
+    'extra_trees': {
+        'n_estimators': [100, 300],
+        'max_depth': [None, 20],
+        'min_samples_leaf': [1, 3],
+    },
+    'scaled_svm': {
+        'C': [1, 10, 100],
+        'gamma': ['scale', 0.01],
+    },
+}
+
+# Tree models get n_jobs=1: the search already uses every core, and a single-threaded
+# forest is also faster for the one-image predictions made at serving time
+SINGLE_THREADED = {'random_forest': {'n_jobs': 1}, 'extra_trees': {'n_jobs': 1}}
+
+
+def list_images(dataset_path, classes):
+    """Return (path, label) pairs for every image in the dataset's class folders"""
+    images = []
+    for label, category in enumerate(classes):
+        path = os.path.join(dataset_path, category)
+        if not os.path.exists(path):
+            logger.error(f"Skipping non-existent category: {category}")
+            continue
+
+        for img_name in sorted(os.listdir(path)):
+            if img_name.lower().endswith(('.png', '.jpg', '.jpeg')):
+                images.append((os.path.join(path, img_name), label))
+    return images
+
+
+def dataset_fingerprint(detector, images):
+    """Hash of the feature extractor source and the image paths, sizes and modification
+    times, used to validate the cache"""
+    digest = hashlib.sha256()
+    digest.update(inspect.getsource(type(detector).extract_features).encode())
+    for path, label in images:
+        stat = os.stat(path)
+        digest.update(f"{path}|{label}|{stat.st_size}|{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def _extract(detector, img_path):
+    img = cv2.imread(img_path)
+    if img is None:
+        logger.warning(f"Skipping unreadable image: {img_path}")
+        return None
+    try:
+        return detector.extract_features(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+    except Exception as e:
+        logger.error(f"Error processing {img_path}: {e}")
+        return None
+
+
+def _feature_count(detector, images):
+    """Length of the feature vector the current extractor produces"""
+    for path, _ in images:
+        features = _extract(detector, path)
+        if features is not None:
+            return len(features)
+    raise ValueError("No images could be processed. Check your dataset path.")
+
+
+def load_features(detector, dataset_path, cache_path, n_jobs=-1, refresh=False):
+    """Load features from the cache, or extract them in parallel and write the cache"""
+    images = list_images(dataset_path, detector.classes)
+    if not images:
+        raise ValueError("No images found. Check your dataset path.")
+    fingerprint = dataset_fingerprint(detector, images)
+
+    if cache_path and os.path.exists(cache_path) and not refresh:
+        with np.load(cache_path) as cached:
+            X, y, cached_fingerprint = cached['X'], cached['y'], str(cached['fingerprint'])
+
+        if cached_fingerprint != fingerprint:
+            logger.warning("Dataset or feature extractor changed since the feature cache was written, re-extracting")
+        elif X.ndim != 2 or X.shape[1] != _feature_count(detector, images):
+            logger.warning("Cached features have the wrong width, re-extracting")
+        else:
+            logger.info(f"Loaded {len(y)} cached feature vectors from {cache_path}")
+            return X, y
+
+    logger.info(f"Extracting features from {len(images)} images...")
+    start = time.perf_counter()
+    features = Parallel(n_jobs=n_jobs)(delayed(_extract)(detector, path) for path, _ in images)
+
+    X = np.array([f for f in features if f is not None])
+    y = np.array([label for f, (_, label) in zip(features, images) if f is not None])
+    logger.info(f"Extracted {len(y)} feature vectors in {time.perf_counter() - start:.1f}s")
+
+    if cache_path:
+        np.savez_compressed(cache_path, X=X, y=y, fingerprint=fingerprint)
+        logger.info(f"Saved feature cache to {cache_path}")
+    return X, y
+
+
+def build_candidates(model_types):
+    candidates = []
+    for model_type in model_types:
+        space = SEARCH_SPACE[model_type]
+        for values in itertools.product(*space.values()):
+            params = dict(zip(space.keys(), values))
+            candidates.append({'model_type': model_type, 'params': params})
+    return candidates
+
+
+def measure_latency(classifier, samples, repeats=3):
+    """Median seconds for one single-image prediction, as made by highlight_tumor_region"""
+    timings = []
+    for _ in range(repeats):
+        for x in samples:
+            start = time.perf_counter()
+            classifier.predict([x])
+            classifier.predict_proba([x])
+            timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def _evaluate_fold(detector, candidate, X, y, train_idx, test_idx, keep_model):
+    params = {**SINGLE_THREADED.get(candidate['model_type'], {}), **candidate['params']}
+    classifier = detector.build_classifier(candidate['model_type'], **params)
+    classifier.fit(X[train_idx], y[train_idx])
+    accuracy = accuracy_score(y[test_idx], classifier.predict(X[test_idx]))
+    return accuracy, classifier if keep_model else None
+
+
+def _accuracy_se(accuracy, n):
+    """Binomial standard error of an accuracy measured on n test images"""
+    return np.sqrt(accuracy * (1 - accuracy) / n)
+
+
+def search(detector, X, y, candidates, n_folds=5, warmup_folds=2, tolerance=0.02, prune_z=2.0,
+           n_jobs=-1, latency_samples=20, random_state=42):
+    """Stratified k-fold search that stops evaluating clearly losing candidates early.
+
+    Every candidate is scored on the first warmup_folds folds. A candidate is pruned when
+    its warmup accuracy trails the best by more than prune_z standard errors of the
+    difference (and by at least tolerance), so small test folds need a larger gap.
+    Only the survivors are scored on the remaining folds. Latency is timed afterwards,
+    one candidate at a time, on the model each candidate fitted for the first fold.
+    """
+    folds = list(StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=random_state).split(X, y))
+    results = [dict(c, fold_accuracies=[], pruned=False) for c in candidates]
+    first_fold_models = {}
+
+    with Parallel(n_jobs=n_jobs) as parallel:
+        for warmup, round_folds in ((True, folds[:warmup_folds]), (False, folds[warmup_folds:])):
+            active = [r for r in results if not r['pruned']]
+            if not round_folds:
+                continue
+
+            logger.info(f"Evaluating {len(active)} candidates on {len(round_folds)} folds...")
+            scores = parallel(
+                delayed(_evaluate_fold)(detector, r, X, y, train_idx, test_idx, keep_model=k == 0 and not r['fold_accuracies'])
+                for r in active
+                for k, (train_idx, test_idx) in enumerate(round_folds)
+            )
+
+            for i, r in enumerate(active):
+                for accuracy, model in scores[i * len(round_folds):(i + 1) * len(round_folds)]:
+                    r['fold_accuracies'].append(float(accuracy))
+                    if model is not None:
+                        first_fold_models[id(r)] = model
+
+            if warmup and len(folds) > warmup_folds:
+                n_test = sum(len(test_idx) for _, test_idx in round_folds)
+                fold_sizes = [len(test_idx) for _, test_idx in round_folds]
+                warmup_accuracy = {id(r): np.average(r['fold_accuracies'], weights=fold_sizes) for r in active}
+                best = max(warmup_accuracy.values())
+                for r in active:
+                    accuracy = warmup_accuracy[id(r)]
+                    margin = prune_z * np.hypot(_accuracy_se(best, n_test), _accuracy_se(accuracy, n_test))
+                    if best - accuracy > max(margin, tolerance):
+                        r['pruned'] = True
+
+    # Timed serially once the worker pool is closed, so other fits don't skew the numbers
+    latency_X = X[folds[0][1]][:latency_samples]
+    for r in results:
+        r['mean_accuracy'] = float(np.mean(r['fold_accuracies']))
+        r['std_accuracy'] = float(np.std(r['fold_accuracies']))
+        r['latency_ms'] = measure_latency(first_fold_models.pop(id(r)), latency_X) * 1000
+        r['folds_evaluated'] = len(r['fold_accuracies'])
+
+    # Fully evaluated candidates rank first, then by accuracy, then by latency
+    results.sort(key=lambda r: (r['pruned'], -r['mean_accuracy'], r['latency_ms']))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train and export the TumourScope classifier")
+    parser.add_argument('--dataset', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Datasets'),
+                        help="Directory containing normal/, benign/ and malignant/ image folders")
+    parser.add_argument('--output', default='model.joblib', help="Where to write the best model")
+    parser.add_argument('--features', default='features.npz', help="Feature cache file ('' to disable)")
+    parser.add_argument('--refresh-features', action='store_true', help="Re-extract features even if cached")
+    parser.add_argument('--models', nargs='+', choices=sorted(SEARCH_SPACE), default=sorted(SEARCH_SPACE))
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--warmup-folds', type=int, default=2,
+                        help="Folds every candidate is scored on before pruning (0 disables pruning)")
+    parser.add_argument('--prune-z', type=float, default=2.0,
+                        help="Prune candidates this many standard errors below the best warmup accuracy")
+    parser.add_argument('--tolerance', type=float, default=0.02,
+                        help="Never prune candidates less than this far below the best warmup accuracy")
+    parser.add_argument('--jobs', type=int, default=-1, help="Parallel workers (-1 uses all cores)")
+    parser.add_argument('--report', help="Optional path for a JSON report of every candidate")
+    args = parser.parse_args(argv)
+
+    detector = TraditionalTumorDetector(dataset_path=args.dataset)
+    X, y = load_features(detector, args.dataset, args.features or None, n_jobs=args.jobs,
+                         refresh=args.refresh_features)
+
+    unique, counts = np.unique(y, return_counts=True)
+    for u, c in zip(unique, counts):
+        logger.info(f"{detector.classes[u]}: {c} images")
+
+    candidates = build_candidates(args.models)
+    start = time.perf_counter()
+    results = search(detector, X, y, candidates, n_folds=args.folds, warmup_folds=args.warmup_folds,
+                     tolerance=args.tolerance, prune_z=args.prune_z, n_jobs=args.jobs)
+    logger.info(f"Searched {len(candidates)} candidates in {time.perf_counter() - start:.1f}s")
+
+    logger.info("\nCandidates (accuracy, latency per image):")
+    for r in results:
+        status = f"pruned after {r['folds_evaluated']} folds" if r['pruned'] else ''
+        logger.info(f"  {r['mean_accuracy']:.4f} +/- {r['std_accuracy']:.4f}  {r['latency_ms']:.2f} ms  "
+                    f"{r['model_type']} {r['params']} {status}")
+
+    best = results[0]
+    logger.info(f"\nBest: {best['model_type']} {best['params']} ({best['mean_accuracy']:.4f})")
+
+    # Refit the winner on the full dataset and time the model that will be deployed
+    params = {**SINGLE_THREADED.get(best['model_type'], {}), **best['params']}
+    detector.classifier = detector.build_classifier(best['model_type'], **params)
+    detector.classifier.fit(X, y)
+    latency_ms = measure_latency(detector.classifier, X[:20]) * 1000
+    logger.info(f"Final model latency: {latency_ms:.2f} ms per image")
+
+    metadata = {
+        'model_type': best['model_type'],
+        'params': best['params'],
+        'cv_accuracy': best['mean_accuracy'],
+        'cv_accuracy_std': best['std_accuracy'],
+        'latency_ms': latency_ms,
+        'n_samples': int(len(y)),
+        'n_features': int(X.shape[1]),
+        'trained_at': int(time.time()),
+    }
+    detector.save_model(args.output, metadata=metadata)
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'best': metadata, 'candidates': results}, f, indent=2, default=str)
+        logger.info(f"Wrote search report to {args.report}")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,11 @@
 import cv2
 import numpy as np
 import os
-from sklearn.ensemble import RandomForestClassifier
+import joblib
+from sklearn.ensemble import RandomForestClassifier, ExtraTreesClassifier
 from sklearn.svm import SVC
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, classification_report
 from skimage.feature import graycomatrix, graycoprops
@@ -148,12 +151,7 @@ class TraditionalTumorDetector:
             logger.info(f"\nTraining on {X_train.shape[0]} samples, testing on {X_test.shape[0]} samples")
             logger.info(f"Feature vector size: {X_train.shape[1]}")
 
-            if model_type == 'random_forest':
-                self.classifier = RandomForestClassifier(n_estimators=100, random_state=42)
-            elif model_type == 'svm':
-                self.classifier = SVC(probability=True, random_state=42)
-            else:
-                raise ValueError(f"Unsupported model type: {model_type}")
+            self.classifier = self.build_classifier(model_type)
 
             logger.info(f"Training {model_type} classifier...")
             self.classifier.fit(X_train, y_train)
@@ -178,6 +176,48 @@ class TraditionalTumorDetector:
             logger.error(f"Error training model: {str(e)}")
             raise
 
+    def build_classifier(self, model_type='random_forest', **params):
+        """Create an untrained classifier of the given type, overriding its defaults with params"""
+        if model_type == 'random_forest':
+            return RandomForestClassifier(**{'n_estimators': 100, 'random_state': 42, **params})
+        elif model_type == 'extra_trees':
+            return ExtraTreesClassifier(**{'n_estimators': 100, 'random_state': 42, **params})
+        elif model_type == 'svm':
+            return SVC(**{'probability': True, 'random_state': 42, **params})
+        elif model_type == 'scaled_svm':
+            return make_pipeline(StandardScaler(), SVC(**{'probability': True, 'random_state': 42, **params}))
+        else:
+            raise ValueError(f"Unsupported model type: {model_type}")
+
+    def save_model(self, model_path, metadata=None):
+        """Save the trained classifier so it can be loaded without retraining"""
+        if self.classifier is None:
+            raise ValueError("Model not trained yet. Call train_model() first.")
+
+        joblib.dump({
+            'classifier': self.classifier,
+            'classes': self.classes,
+            'metadata': metadata or {}
+        }, model_path)
+        logger.info(f"Saved model to {model_path}")
+
+    def load_model(self, model_path):
+        """Load a classifier saved with save_model()"""
+        artifact = joblib.load(model_path)
+        if artifact['classes'] != self.classes:
+            raise ValueError(f"Model classes {artifact['classes']} do not match {self.classes}")
+
+        # Models trained before extract_features changed would fail on every prediction
+        n_features = artifact['metadata'].get('n_features')
+        if n_features is not None:
+            expected = len(self.extract_features(np.zeros((224, 224, 3), dtype=np.uint8)))
+            if n_features != expected:
+                raise ValueError(f"Model expects {n_features} features but the extractor produces {expected}")
+
+        self.classifier = artifact['classifier']
+        logger.info(f"Loaded model from {model_path}")
+        return artifact['metadata']
+
     def highlight_tumor_region(self, image_path):
         """Highlight potential tumor regions in an ultrasound image"""
         try: